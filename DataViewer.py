@@ -0,0 +1,208 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtWidgets import QComboBox, QDialog, QHBoxLayout, QLabel, QTableView, QVBoxLayout
+
+from GlobalVariables import FileLoc
+
+# Columns which get a value index for instant filtering
+INDEX_COLUMNS = ['Line', 'File Date', 'FSE Code', 'Lookup Flag']
+# Rows paged into the view at a time
+PAGE_SIZE = 500
+ALL_VALUES = "<All>"
+
+class DataFrameModel(QtCore.QAbstractTableModel):
+    """Table model which pages dataframe rows into the view on demand"""
+
+    def __init__(self, df, flag_colors):
+        super(DataFrameModel, self).__init__()
+        self.headers = list(df.columns)
+        self.column_values = [df[column].to_numpy(dtype=object) for column in self.headers]
+        self.num_rows = len(df)
+        self.flag_colors = {flag: QtGui.QColor(color) for flag, color in flag_colors.items()}
+        self.customer_col = self.headers.index('Reported Customer') if 'Reported Customer' in self.headers else -1
+        self.flag_col = self.headers.index('Lookup Flag') if 'Lookup Flag' in self.headers else -1
+
+        # <= BUILD VALUE INDEXES FOR FILTER COLUMNS =>
+        self.indexes = {}
+        for column in INDEX_COLUMNS:
+            if column in self.headers:
+                values = pd.Series(df[column].astype(str).to_numpy())
+                self.indexes[column] = values.groupby(values).indices
+        # Sort ranks are built the first time a column is sorted
+        self.sort_ranks = {}
+
+        # <= VISIBLE ROWS =>
+        self.filters = {}
+        self.sort_column = None
+        self.sort_order = QtCore.Qt.AscendingOrder
+        self.order = np.arange(self.num_rows)
+        self.loaded = min(PAGE_SIZE, len(self.order))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.order)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        """Page the next block of rows into the view"""
+        count = min(PAGE_SIZE, len(self.order) - self.loaded)
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.order[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return str(self.column_values[index.column()][row])
+        if role == QtCore.Qt.BackgroundRole and index.column() == self.customer_col and self.flag_col >= 0:
+            # Highlight the customer with its lookup flag color, like the Excel output
+            return self.flag_colors.get(self.column_values[self.flag_col][row])
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def sortRanks(self, column):
+        """ Rank of every row for a column, computed once per column
+        :param column: Column position
+        :return: (array) Sort rank per row
+        """
+        if column not in self.sort_ranks:
+            ranks = np.empty(self.num_rows, dtype=np.int64)
+            ranks[self.sortOrder(self.column_values[column])] = np.arange(self.num_rows)
+            self.sort_ranks[column] = ranks
+        return self.sort_ranks[column]
+
+    def sortOrder(self, values):
+        """ Row order for a column, comparing numbers and dates by value
+            when the whole column converts, and as text otherwise
+        :param values: Column values
+        :return: (array) Row positions in sorted order
+        """
+        # Blanks were filled with "", sort them last
+        typed_values = pd.Series(values).replace("", None)
+        try:
+            typed = pd.to_numeric(typed_values)
+        except (ValueError, TypeError):
+            typed = None
+            # Only cells which already are dates, text is never parsed as one
+            if typed_values.dropna().map(lambda x: isinstance(x, datetime)).all():
+                typed = pd.to_datetime(typed_values)
+        if typed is not None:
+            return typed.sort_values(kind='stable', na_position='last').index.to_numpy()
+        return np.argsort(values.astype(str), kind='stable')
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort visible rows by a column, or restore file order if column < 0"""
+        self.sort_column = column if column >= 0 else None
+        self.sort_order = order
+        self.refresh()
+
+    def setFilter(self, column, value):
+        """ Show only rows where an indexed column has a value
+        :param column: Indexed column name
+        :param value: Value to keep, or ALL_VALUES
+        :return: (void) refresh visible rows
+        """
+        if value == ALL_VALUES:
+            self.filters.pop(column, None)
+        else:
+            self.filters[column] = value
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild visible rows from the indexes, then sort them"""
+        self.beginResetModel()
+
+        # <= FILTER USING INDEXES =>
+        order = None
+        for column, value in self.filters.items():
+            rows = self.indexes[column].get(value, np.array([], dtype=np.int64))
+            order = rows if order is None else np.intersect1d(order, rows, assume_unique=True)
+        if order is None:
+            order = np.arange(self.num_rows)
+
+        # <= SORT USING CACHED RANKS =>
+        if self.sort_column is not None:
+            ranks = self.sortRanks(self.sort_column)[order]
+            order = order[np.argsort(ranks)]
+            if self.sort_order == QtCore.Qt.DescendingOrder:
+                order = order[::-1]
+
+        self.order = order
+        self.loaded = min(PAGE_SIZE, len(self.order))
+        self.endResetModel()
+
+class DataViewer(QDialog):
+    """Window for inspecting an output or master file without Excel"""
+
+    def __init__(self, df, title):
+        super(DataViewer, self).__init__()
+        self.setWindowTitle(title)
+        self.resize(1200, 700)
+
+        # <= LOAD LOOKUP FLAG COLORS =>
+        try:
+            flags = pd.read_excel(FileLoc.FORMAT_MATRIX.value, sheet_name=1).fillna("")
+            flag_colors = dict(zip(flags['Value'], flags['bg_color']))
+        except FileNotFoundError:
+            flag_colors = {}
+
+        # <= BUILD TABLE =>
+        self.model = DataFrameModel(df, flag_colors)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        # Start unsorted, sorting only once a header is clicked
+        self.table.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setDefaultSectionSize(18)
+
+        # <= BUILD FILTERS FOR INDEXED COLUMNS =>
+        filter_layout = QHBoxLayout()
+        for column, index in self.model.indexes.items():
+            combo = QComboBox()
+            combo.addItems([ALL_VALUES] + sorted(index.keys()))
+            combo.currentTextChanged.connect(lambda value, column=column: self.filterRows(column, value))
+            filter_layout.addWidget(QLabel(column + ":"))
+            filter_layout.addWidget(combo)
+        filter_layout.addStretch()
+        self.lbl_row_count = QLabel()
+        filter_layout.addWidget(self.lbl_row_count)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.table)
+        self.updateRowCount()
+
+    def filterRows(self, column, value):
+        """Apply a filter and update the row count"""
+        self.model.setFilter(column, value)
+        self.updateRowCount()
+
+    def updateRowCount(self):
+        self.lbl_row_count.setText(f"{len(self.model.order):,} of {self.model.num_rows:,} rows")
+
+    @staticmethod
+    def fromFile(excel_helper, filepath, sheet='Data'):
+        """ Open a viewer on an Excel file (or its columnar twin)
+        :param excel_helper: ExcelHelper used to read the file
+        :param filepath: Path to the file
+        :param sheet: Name of the first sheet
+        :return: DataViewer
+        """
+        df = excel_helper.readFile(filepath, sheet, use_twin=True)
+        return DataViewer(df, os.path.basename(filepath))
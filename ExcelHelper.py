@@ -3,11 +3,23 @@ import os
 import shutil
 import pandas as pd
 from datetime import datetime
-import win32com.client as win32
+try:
+    import win32com.client as win32
+except ImportError:  # Excel automation is only available on Windows
+    win32 = None
 
-from GlobalVariables import FileLoc
+from GlobalVariables import FileLoc, TwinFormat
 from FormatHelper import FormatHelper
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet twins are optional
+    pyarrow = None
+
+# Parquet metadata key holding the size and mtime of the twin's workbook
+TWIN_SOURCE_KEY = b"h2.source"
+
 class ExcelHelper:
 
     def __init__(self):
@@ -31,6 +43,12 @@ class ExcelHelper:
         :param filepath: Path to the file
         :return: (void) Open file
         """
+        filename = os.path.basename(filepath)
+        if win32 is None:
+            print(f"> Excel is not available to open {filename}."
+                  f" Use the in-app viewer to inspect it.")
+            return
+
         # Open file using OS commands (pywin32)
         excel = win32.Dispatch("Excel.Application")
         excel.WindowState = -4137  # xlMaximized
@@ -40,7 +58,6 @@ class ExcelHelper:
         workbook.Activate()
         excel.Windows(workbook.Name).Activate()
 
-        filename = os.path.basename(filepath)
         print(f"> Launched {filename}")
 
     def backupFile(self, filepath):
@@ -69,13 +86,201 @@ class ExcelHelper:
             shutil.copy(filepath, backup_path)
             print(f"> {filename} successfully backed up!")
 
-    def createFile(self, filepath, dfs, sheets, widths):
+    def twinPath(self, filepath, sheet, twin):
+        """ Path to the columnar twin of one sheet of an Excel file
+        :param filepath: Path to the Excel file
+        :param sheet: Name of the sheet
+        :param twin: TwinFormat of the twin
+        :return: (string) Twin filepath
+        """
+        root, ext = os.path.splitext(filepath)
+        return f"{root} ({sheet}){twin.value}"
+
+    def columnarFrame(self, df):
+        """ Give every column a single type, so it can be stored columnar.
+            Blanks in numeric or date columns go back to NaN/NaT, which
+            fillna("") restores exactly as read_excel would
+        :param df: Dataframe read or built by the program
+        :return: (dataframe) Column-typed copy
+        """
+        columnar_df = df.copy()
+        for column in columnar_df.columns:
+            if columnar_df[column].dtype != object:
+                continue
+            values = columnar_df[column][columnar_df[column] != ""]
+            if values.map(lambda x: isinstance(x, (int, float)) and not isinstance(x, bool)).all():
+                columnar_df[column] = pd.to_numeric(columnar_df[column].replace("", None)).astype(float)
+            elif len(values) and values.map(lambda x: isinstance(x, datetime)).all():
+                columnar_df[column] = pd.to_datetime(columnar_df[column].replace("", None))
+            else:
+                columnar_df[column] = columnar_df[column].astype(str)
+        return columnar_df
+
+    def sourceStamp(self, filepath):
+        """ Identify the exact version of a workbook a twin was written from
+        :param filepath: Path to the Excel file
+        :return: (bytes) Size and modified time of the file
+        """
+        stat = os.stat(filepath)
+        return f"{stat.st_size}:{stat.st_mtime_ns}".encode()
+
+    def tempPath(self, filepath):
+        """ Temp file next to the target, so the final rename is atomic
+        :param filepath: Path to the final file
+        :return: (string) Temp filepath
+        """
+        return os.path.join(os.path.dirname(filepath), f".~{os.getpid()}_{os.path.basename(filepath)}")
+
+    def createTwin(self, filepath, df, sheet, twin, source_stamp):
+        """ Write a columnar twin of one sheet to a temp file
+        :param filepath: Path to the Excel file
+        :param df: Dataframe written to the sheet
+        :param sheet: Name of the sheet
+        :param twin: TwinFormat of the twin
+        :param source_stamp: sourceStamp of the workbook version df holds,
+                             stored in Parquet twins
+        :return: [temp_path, twin_path], or None if skipped
+        """
+        if twin == TwinFormat.PARQUET and pyarrow is None:
+            print(f"> Skipped Parquet copy of {os.path.basename(filepath)},"
+                  f" pyarrow is not installed.")
+            return None
+        twin_path = self.twinPath(filepath, sheet, twin)
+        temp_path = self.tempPath(twin_path)
+        if twin == TwinFormat.PARQUET:
+            table = pyarrow.Table.from_pandas(self.columnarFrame(df), preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[TWIN_SOURCE_KEY] = source_stamp
+            pyarrow.parquet.write_table(table.replace_schema_metadata(metadata), temp_path)
+        else:
+            df.to_csv(temp_path, index=False)
+        return [temp_path, twin_path]
+
+    def buildFile(self, filepath, dfs, sheets, widths, twin=None, format_matrix=None):
+        """ Write a formatted workbook (and its twins) to temp files.
+            Safe to run in a worker process
+        :param filepath: Path to desired output location
+        :param dfs: Array of dataframes (one per sheet)
+        :param sheets: Array of names for each sheet
+        :param widths: Array of column width arrays for each sheet
+        :param twin: TwinFormat to also write each sheet as (optional)
+        :param format_matrix: Compiled Format Matrix (optional)
+        :return: (list) [temp_path, final_path] pairs, workbook first
+        """
+        # <= WRITE THE OUTPUT FILE =>
+        temp_path = self.tempPath(filepath)
+        writer = pd.ExcelWriter(temp_path,
+                                engine="xlsxwriter",
+                                date_format="yyyy-mm-dd", datetime_format="yyyy-mm-dd")
+        # Get us a format helper
+        format_helper = FormatHelper(writer, format_matrix)
+        # Iterate through arrays of sheet definition
+        for df, sheet, width in zip(dfs, sheets, widths):
+            # Export dataframe to Excel
+            df.to_excel(writer, sheet_name=sheet, index=False)
+            # Format the Excel file
+            format_helper.formatSheet(df, sheet, width)
+        # Save the file
+        writer.close()
+        temp_files = [[temp_path, filepath]]
+
+        # <= WRITE COLUMNAR TWINS FROM THE SAME FRAMES =>
+        if twin:
+            for df, sheet in zip(dfs, sheets):
+                # Renaming the built workbook over filepath keeps its stamp
+                twin_files = self.createTwin(filepath, df, sheet, twin, self.sourceStamp(temp_path))
+                if twin_files:
+                    temp_files.append(twin_files)
+
+        return temp_files
+
+    def commitFiles(self, temp_files):
+        """ Atomically move built temp files over their final paths
+        :param temp_files: [temp_path, final_path] pairs, workbook first
+        :return: (boolean) Whether the workbook was committed
+        """
+        temp_path, filepath = temp_files[0]
+        try:
+            os.replace(temp_path, filepath)
+        except PermissionError:
+            self.discardFiles(temp_files)
+            return False
+        self.commitTwins(temp_files[1:])
+        return True
+
+    def commitTwins(self, twin_files):
+        """ Move built twins over their final paths once their workbook is
+            committed. A twin which can't be replaced is removed, since
+            it no longer matches its workbook
+        :param twin_files: [temp_path, twin_path] pairs
+        :return: (void) commit twins
+        """
+        for temp_path, twin_path in twin_files:
+            try:
+                os.replace(temp_path, twin_path)
+            except PermissionError:
+                self.discardFiles([[temp_path, twin_path]])
+                try:
+                    os.remove(twin_path)
+                except OSError:  # Still open, its stale source stamp keeps it from being read
+                    pass
+                print(f"> Could not update {os.path.basename(twin_path)},"
+                      f" it is open in another program.")
+
+    def discardFiles(self, temp_files):
+        """ Remove built temp files which will not be committed
+        :param temp_files: [temp_path, final_path] pairs
+        :return: (void) delete temp files
+        """
+        for temp_path, _ in temp_files:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    def readFile(self, filepath, sheet, use_twin=False):
+        """ Read the first sheet of an Excel file. Read-only consumers may
+            use its Parquet twin, when the twin was written from exactly
+            this version of the Excel file, and rebuild it from Excel when
+            it wasn't (e.g. after the file was edited by hand). Twins store
+            mixed columns as text, so frames which are written back are
+            always read from Excel. CSV twins are only written for reporting
+        :param filepath: Path to the Excel file
+        :param sheet: Name of the first sheet (used to find its twin)
+        :param use_twin: Whether the frame is only read, never written back
+        :return: (dataframe) Sheet contents with blanks as ""
+        """
+        if not use_twin or pyarrow is None:
+            return pd.read_excel(filepath, sheet_name=0).fillna("")
+
+        # <= USE THE TWIN IF IT WAS WRITTEN FROM THIS VERSION =>
+        twin_path = self.twinPath(filepath, sheet, TwinFormat.PARQUET)
+        try:
+            # Stamp before reading, so a file replaced meanwhile never matches the twin
+            source_stamp = self.sourceStamp(filepath)
+            metadata = pyarrow.parquet.read_schema(twin_path).metadata or {}
+            if metadata.get(TWIN_SOURCE_KEY) == source_stamp:
+                return pd.read_parquet(twin_path).fillna("")
+        except (OSError, pyarrow.ArrowInvalid):
+            pass
+
+        # <= OTHERWISE READ EXCEL AND REBUILD THE TWIN =>
+        df = pd.read_excel(filepath, sheet_name=0).fillna("")
+        try:
+            self.commitTwins([self.createTwin(filepath, df, sheet, TwinFormat.PARQUET, source_stamp)])
+        except (OSError, pyarrow.ArrowException):  # Only a cache, keep going without it
+            pass
+        return df
+
+    def createFile(self, filepath, dfs, sheets, widths, twin=None, format_matrix=None):
         """ Creates an Excel file from dataframes, where each
             dataframe-name-col_width arr defines each sheet
             :param filepath: Path to desired output location
             :param dfs: Array of dataframes (one per sheet)
             :param sheets: Array of names for each sheet
             :param widths: Array of column width arrays for each sheet
+            :param twin: TwinFormat to also write each sheet as (optional)
+            :param format_matrix: Compiled Format Matrix (optional)
             :return: Create file and return New filepath
             """
         filepath = os.path.abspath(filepath)
@@ -96,20 +301,16 @@ class ExcelHelper:
             else:
 
                 # <= WRITE THE OUTPUT FILE =>
-                writer = pd.ExcelWriter(filepath,
-                                        engine="xlsxwriter",
-                                        date_format="yyyy-mm-dd", datetime_format="yyyy-mm-dd")
-                # Get us a format helper
-                format_helper = FormatHelper(writer)
-                # Iterate through arrays of sheet definition
-                for df, sheet, width in zip(dfs, sheets, widths):
-                    # Export dataframe to Excel
-                    df.to_excel(writer, sheet_name=sheet, index=False)
-                    # Format the Excel file
-                    format_helper.formatSheet(df, sheet, width)
-                # Save the file
-                writer.close()
-                print(f"> New file saved at: {filepath}")
+                # Write to temp files first, so readers never see a partial file
+                temp_files = self.buildFile(filepath, dfs, sheets, widths, twin, format_matrix)
+
+                # <= ATOMICALLY REPLACE THE OLD FILE =>
+                if self.commitFiles(temp_files):
+                    print(f"> New file saved at: {filepath}")
+                else:
+                    print(f"> Could not save {filename}, the file is currently open in Excel!"
+                          f" Please close the file and try again.")
+                    filepath = ""
 
         return filepath
 
@@ -0,0 +1,176 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from FormatHelper import FormatHelper
+from LockHelper import FileLock
+
+class ExportHelper:
+
+    def __init__(self, excel_helper):
+        self.excel_helper = excel_helper
+        self.exports = []
+
+    def addFile(self, filepath, sheets, widths, dfs=None, twin=None, prepare=None):
+        """ Queue a workbook to be written by the export stage
+        :param filepath: Path to desired output location
+        :param sheets: Array of names for each sheet
+        :param widths: Array of column width arrays for each sheet
+        :param dfs: Array of dataframes (one per sheet)
+        :param twin: TwinFormat to also write each sheet as (optional)
+        :param prepare: Callable returning dfs, run under the file's lock
+                        at export time (for files merged with the disk copy)
+        :return: (void) queue export
+        """
+        filepath = os.path.abspath(filepath)
+        # Only the last export queued for a file is written
+        self.exports = [export for export in self.exports if export['Path'] != filepath]
+        self.exports.append({'Path': filepath, 'Sheets': sheets, 'Widths': widths,
+                             'Dfs': dfs, 'Twin': twin, 'Prepare': prepare})
+
+    def submitBuild(self, pool, export, format_matrix):
+        """ Start building one workbook to temp files
+        :param pool: ProcessPoolExecutor, or None to build in this process
+        :param export: Queued export with its dfs ready
+        :param format_matrix: Compiled Format Matrix
+        :return: (Future) Temp files of the workbook
+        """
+        args = [export['Path'], export['Dfs'], export['Sheets'], export['Widths'],
+                export['Twin'], format_matrix]
+        if pool is not None:
+            return pool.submit(self.excel_helper.buildFile, *args)
+        future = Future()
+        try:
+            future.set_result(self.excel_helper.buildFile(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def collectBuilds(self, futures):
+        """ Wait for every build, discarding them all if any one failed
+        :param futures: Futures from submitBuild
+        :return: (list) Temp files of each workbook, or None if any failed
+        """
+        built_files = []
+        for future in futures:
+            try:
+                built_files.append(future.result())
+            except Exception as e:
+                print(f"> Export failed: {e}")
+        if len(built_files) < len(futures):
+            for temp_files in built_files:
+                self.excel_helper.discardFiles(temp_files)
+            return None
+        return built_files
+
+    def commitExports(self, built_files):
+        """ Move every built workbook over its final path, putting the
+            previous workbooks back if any one of them can't be replaced.
+            Twins are committed once every workbook is in place
+        :param built_files: Temp files of each workbook
+        :return: (list) Paths of the files written
+        """
+        # <= REPLACE WORKBOOKS, KEEPING THE PREVIOUS VERSIONS =>
+        replaced = []
+        try:
+            for temp_files in built_files:
+                temp_path, filepath = temp_files[0]
+                previous_path = None
+                if os.path.exists(filepath):
+                    previous_path = self.excel_helper.tempPath(filepath) + ".old"
+                    os.replace(filepath, previous_path)
+                replaced.append([filepath, previous_path])
+                os.replace(temp_path, filepath)
+        except PermissionError as e:
+            # <= PUT BACK EVERY WORKBOOK REPLACED SO FAR =>
+            for filepath, previous_path in reversed(replaced):
+                if previous_path:
+                    os.replace(previous_path, filepath)
+                elif os.path.exists(filepath):
+                    os.remove(filepath)
+            for temp_files in built_files:
+                self.excel_helper.discardFiles(temp_files)
+            print(f"> Could not save {os.path.basename(e.filename or '')}, the file is currently"
+                  f" open in Excel! Please close the file and try again. No files were exported.")
+            return []
+
+        # <= COMMIT TWINS, THEN DROP PREVIOUS WORKBOOKS =>
+        written_paths = []
+        for temp_files in built_files:
+            self.excel_helper.commitTwins(temp_files[1:])
+        for filepath, previous_path in replaced:
+            if previous_path:
+                os.remove(previous_path)
+            written_paths.append(filepath)
+            print(f"> New file saved at: {filepath}")
+        return written_paths
+
+    def exportFiles(self, open_files=False):
+        """ Build every queued workbook in parallel, then commit them all
+            together once every one of them has been built. Files merged
+            with their disk copy are locked and prepared while the other
+            files build, then built and committed under their locks
+        :param open_files: Whether to open the files in Excel afterwards
+        :return: (list) Paths of the files written
+        """
+        if not self.exports:
+            return []
+        print(f"..Exporting {len(self.exports)} files..")
+
+        # <= VERIFY THAT EVERY FILE IS GOOD TO EXPORT =>
+        for export in self.exports:
+            if self.excel_helper.saveError(export['Path']):
+                print(f"> Could not export, {os.path.basename(export['Path'])} is currently open"
+                      f" in Excel! Please close the file and try again.")
+                self.exports = []
+                return []
+
+        # Compile the Format Matrix once for every workbook
+        format_matrix = FormatHelper.loadFormatMatrix()
+        unlocked_exports = [export for export in self.exports if not export['Prepare']]
+        locked_exports = sorted((export for export in self.exports if export['Prepare']),
+                                key=lambda export: export['Path'])
+        num_exports = len(self.exports)
+        self.exports = []
+
+        # Build in worker processes when there are several workbooks
+        pool = ProcessPoolExecutor(max_workers=min(num_exports, os.cpu_count() or 1)) if num_exports > 1 else None
+        file_locks = []
+        try:
+            # <= START FILES WHICH DON'T NEED LOCKS =>
+            unlocked_futures = [self.submitBuild(pool, export, format_matrix) for export in unlocked_exports]
+
+            # <= MEANWHILE, LOCK AND PREPARE FILES WHICH ARE MERGED WITH THEIR DISK COPY =>
+            # Sorted, so two operators never wait on each other's locks
+            try:
+                for export in locked_exports:
+                    file_lock = FileLock(export['Path'])
+                    file_lock.acquire()
+                    file_locks.append(file_lock)
+            except TimeoutError as e:
+                built_files = self.collectBuilds(unlocked_futures) or []
+                for temp_files in built_files:
+                    self.excel_helper.discardFiles(temp_files)
+                print(f"> Could not export. {e}.")
+                return []
+            for export in locked_exports:
+                export['Dfs'] = export['Prepare']()
+            locked_futures = [self.submitBuild(pool, export, format_matrix) for export in locked_exports]
+
+            # <= WAIT FOR EVERY BUILD, THEN COMMIT ALL FILES AT THE END =>
+            built_files = self.collectBuilds(unlocked_futures + locked_futures)
+            if built_files is None:
+                print("> No files were exported.")
+                return []
+            written_paths = self.commitExports(built_files)
+        finally:
+            for file_lock in file_locks:
+                file_lock.release()
+            if pool is not None:
+                pool.shutdown()
+
+        # <= OPEN FILES ONCE EVERYTHING IS WRITTEN =>
+        if open_files:
+            for filepath in written_paths:
+                self.excel_helper.openFile(filepath)
+
+        return written_paths
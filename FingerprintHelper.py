@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+
+from GlobalVariables import FileLoc
+from LockHelper import FileLock
+
+class FingerprintHelper:
+
+    def __init__(self):
+        self.manifest_path = FileLoc.MANIFEST.value
+        self.manifest = self.loadManifest()
+
+    def loadManifest(self):
+        """ Load the manifest of previously processed inputs
+        :return: (dict) Section name mapped to its fingerprint records
+        """
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def hashFile(self, filepath):
+        """ Hash the content of a file
+        :param filepath: Path to the file
+        :return: (string) SHA-256 hex digest, or "" if file is missing
+        """
+        sha = hashlib.sha256()
+        try:
+            with open(filepath, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    sha.update(chunk)
+        except FileNotFoundError:
+            return ""
+        return sha.hexdigest()
+
+    def fingerprint(self, filepaths):
+        """ Combine the content hashes of several files into one fingerprint
+        :param filepaths: Paths to every file the result depends on
+        :return: (string) SHA-256 hex digest
+        """
+        sha = hashlib.sha256()
+        for filepath in filepaths:
+            sha.update(os.path.basename(filepath).encode())
+            sha.update(self.hashFile(filepath).encode())
+        return sha.hexdigest()
+
+    def getRecord(self, section, key):
+        """ Find a previously recorded result
+        :param section: Manifest section (e.g. "Assign FSE")
+        :param key: Record key within the section
+        :return: (dict) Recorded entry, or None if not found
+        """
+        return self.manifest.get(section, {}).get(key)
+
+    def setRecord(self, section, key, entry):
+        """ Record a processed result in the manifest
+        :param section: Manifest section (e.g. "Assign FSE")
+        :param key: Record key within the section
+        :param entry: (dict) Data to record
+        :return: (void) write manifest
+        """
+        with FileLock(self.manifest_path):
+            # Reload, so we keep records written by other operators
+            self.manifest = self.loadManifest()
+            self.manifest.setdefault(section, {})[key] = entry
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, 'w') as manifest_file:
+                json.dump(self.manifest, manifest_file, indent=1)
+            os.replace(temp_path, self.manifest_path)
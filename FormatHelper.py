@@ -6,31 +6,53 @@ from GlobalVariables import FileLoc
 
 class FormatHelper:
 
-    def __init__(self, writer):
+    def __init__(self, writer, format_matrix=None):
         self.writer = writer
-        columns, flags = [pd.read_excel(FileLoc.FORMAT_MATRIX.value, sheet_name=i).fillna("") for i in range(2)]
+        # Compile the Format Matrix unless we were handed a compiled one
+        if format_matrix is None:
+            format_matrix = FormatHelper.loadFormatMatrix()
 
-        # <= EXTRACT FORMATS FOR COLUMNS =>
+        # <= ADD COLUMN FORMATS TO WORKBOOK =>
         self.column_formats = {}
         self.format_columns = {}
+        for name, font_dict, format_columns in format_matrix['columns']:
+            # Add font to column formats dictionary
+            self.column_formats[name] = writer.book.add_format(font_dict)
+            # Pull columns which have this format
+            self.format_columns[name] = format_columns
+
+        # <= ADD FLAG FORMATS TO WORKBOOK =>
+        self.flag_formats = {}
+        for value, font_dict in format_matrix['flags']:
+            self.flag_formats[value] = writer.book.add_format(font_dict)
+
+    @staticmethod
+    def loadFormatMatrix():
+        """ Read the Format Matrix into plain format definitions, which
+            can be shared by every workbook (and worker process) in a run
+        :return: (dict) Column and flag format definitions
+        """
+        columns, flags = [pd.read_excel(FileLoc.FORMAT_MATRIX.value, sheet_name=i).fillna("") for i in range(2)]
+
+        # <= EXTRACT FORMATS FOR COLUMNS =>
+        column_formats = []
         for i in columns.index:
             name = columns.loc[i, 'Name']
             # Create dict to store all of this font's attributes
             font_dict = {}
             for attr in ['font', 'font_size', 'num_format', 'align']:
                 font_dict[attr] = columns.loc[i, attr]
-            # Add font to column formats dictionary
-            self.column_formats[name] = writer.book.add_format(font_dict)
-            # Pull columns which have this format
-            self.format_columns[name] = columns.loc[i, 'Columns'].split(sep="@")
+            column_formats.append([name, font_dict, columns.loc[i, 'Columns'].split(sep="@")])
 
         # <= EXTRACT FLAG FORMATS =>
-        self.flag_formats = {}
+        flag_formats = []
         for i in flags.index:
             font_dict = {}
             for attr in ['font', 'font_size', 'bg_color']:
                 font_dict[attr] = flags.loc[i, attr]
-            self.flag_formats[flags.loc[i, 'Value']] = writer.book.add_format(font_dict)
+            flag_formats.append([flags.loc[i, 'Value'], font_dict])
+
+        return {'columns': column_formats, 'flags': flag_formats}
 
     def formatSheet(self, df, sheet, width):
         """ Formats our output file to make it look nice
@@ -7,8 +7,22 @@ class FileLoc(Enum):
     LOOKUP = BASE + "Lookup/"
     OUTPUT = BASE + "Output/"
     INPUT = BASE + "Input/"
+    MANIFEST = OUTPUT + "Manifest.json"
     MASTER = BASE + "H2 Commissions Master.xlsx"
+    MASTER_JOURNAL = BASE + "Journal/"
     FIELD_MAPPINGS = LOOKUP + "Field Mappings.xlsx"
     LOOKUP_MATRIX = LOOKUP + "Lookup Matrix.xlsx"
     FORMAT_MATRIX = LOOKUP + "Format Matrix.xlsx"
+    APPLIED_LOOKUPS = LOOKUP + "Applied Lookups.json"
+    PATH_STATS = LOOKUP + "Path Statistics.json"
 
+
+class TwinFormat(Enum):
+    PARQUET = ".parquet"
+    CSV = ".csv"
+
+
+class Settings(Enum):
+    # Twin written next to every workbook. Parquet twins are also read back for
+    # speed, CSV twins are only for downstream reporting
+    TWIN_FORMAT = TwinFormat.PARQUET
@@ -0,0 +1,111 @@
+import os
+import time
+import uuid
+import pandas as pd
+
+try:
+    import msvcrt
+except ImportError:  # Not on Windows
+    msvcrt = None
+    import fcntl
+
+class FileLock:
+
+    def __init__(self, filepath, timeout=120):
+        self.lock_path = f"{filepath}.lock"
+        self.filename = os.path.basename(filepath)
+        self.timeout = timeout
+        self.lock_file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        """ Take the cross-process advisory lock, waiting for other operators
+        :return: (void) hold lock or raise TimeoutError
+        """
+        self.lock_file = open(self.lock_path, 'a+')
+        start = time.time()
+        waiting = False
+        while True:
+            try:
+                self.lock_file.seek(0)
+                if msvcrt:
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError:
+                if time.time() - start > self.timeout:
+                    self.lock_file.close()
+                    self.lock_file = None
+                    raise TimeoutError(f"{self.filename} is locked by another operator")
+                if not waiting:
+                    print(f"..Waiting for another operator to finish with {self.filename}..")
+                    waiting = True
+                time.sleep(0.1)
+
+    def release(self):
+        """ Release the lock so other operators can write
+        :return: (void) release lock
+        """
+        if self.lock_file is None:
+            return
+        self.lock_file.seek(0)
+        if msvcrt:
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+class JournalHelper:
+
+    def __init__(self, journal_dir):
+        self.journal_dir = journal_dir
+        os.makedirs(self.journal_dir, exist_ok=True)
+
+    def append(self, df):
+        """ Queue a dataframe in the write-ahead journal
+        :param df: Rows to be merged into the journaled file
+        :return: (string) Path to the journal entry
+        """
+        # Timestamp first, so entries sort in the order they were queued
+        entry_name = f"{time.time_ns()}_{uuid.uuid4().hex}.xlsx"
+        entry_path = os.path.join(self.journal_dir, entry_name)
+        temp_path = os.path.join(self.journal_dir, f".~{entry_name}")
+        # Excel, not pickle, since anyone with access to the shared folder could write an entry,
+        # and it reads back exactly as the input (and master) are read
+        df.to_excel(temp_path, index=False, engine="xlsxwriter")
+        os.replace(temp_path, entry_path)
+        return entry_path
+
+    def pendingEntries(self):
+        """ Read all queued journal entries in order
+        :return: (list) [entry_path, dataframe] pairs
+        """
+        entry_names = sorted(name for name in os.listdir(self.journal_dir)
+                             if name.endswith(".xlsx") and not name.startswith(".~"))
+        entries = []
+        for entry_name in entry_names:
+            entry_path = os.path.join(self.journal_dir, entry_name)
+            try:
+                entries.append([entry_path, pd.read_excel(entry_path, sheet_name=0).fillna("")])
+            except FileNotFoundError:  # Merged and cleared by another operator meanwhile
+                pass
+        return entries
+
+    def clearEntries(self, entry_paths):
+        """ Remove journal entries once they are merged
+        :param entry_paths: Paths of merged entries
+        :return: (void) delete entries
+        """
+        for entry_path in entry_paths:
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
@@ -1,17 +1,24 @@
 
+import os
+import json
+import numpy as np
 import pandas as pd
 
-from GlobalVariables import FileLoc
+from ExcelHelper import ExcelHelper
+from GlobalVariables import FileLoc, Settings
+from LockHelper import FileLock
 
 class LookupHelper:
 
-    def __init__(self):
+    def __init__(self, load_files=True):
         self.standardize_helper = None
-        self.excel_helper = None
+        self.excel_helper = ExcelHelper()
+        self.export_helper = None
+        self.string_pool = StringPool()
         files_, columns, values = [pd.read_excel(FileLoc.LOOKUP_MATRIX.value, sheet_name=i).fillna("") for i in range(3)]
         self.files = {}
         for n in files_['Number']:
-            self.files[n] = File(files_, n)
+            self.files[n] = File(files_, n, self.excel_helper, self.string_pool, load_files)
         self.standard_name_dict = {}
         for i, lookup_name in enumerate(columns['Lookup Name']):
             self.standard_name_dict[lookup_name] = columns.loc[i, 'Standard Name']
@@ -26,6 +33,7 @@ class LookupHelper:
                 self.paths[value].append(path)
             else:
                 self.paths[value] = [path]
+        self.path_stats = self.loadPathStats()
 
     def setStandardizeHelper(self, standardize_helper):
         self.standardize_helper = standardize_helper
@@ -33,11 +41,15 @@ class LookupHelper:
     def setExcelHelper(self, excel_helper):
         self.excel_helper = excel_helper
 
-    def performLookup(self, standard_df, value):
+    def setExportHelper(self, export_helper):
+        self.export_helper = export_helper
+
+    def performLookup(self, standard_df, value, update_files=True):
         """ For each row of the dataframe, perform lookups
         which determine the value
         :param standard_df: Standardized columns
         :param value: Name of column which we perform lookup for
+        :param update_files: Whether to write ENF entries back to lookup files
         :return: Standardized, preprocessed, generated DF
                  with lookup value populated
         """
@@ -45,40 +57,46 @@ class LookupHelper:
 
         # Set flag to know which lookup files have entries need fixing
         files_enf = []
+        # Hit, miss and ENF counts from this run
+        run_stats = {}
 
         for i in lookup_df.index:
             lookup_flag = ""
+            line = str(lookup_df.loc[i, 'Line']) if 'Line' in lookup_df.columns else ""
+            self.lineStats(run_stats, value, line)["Rows"] += 1
 
             # <= ATTEMPT ALL LOOKUP PATHS =>
             num_paths = len(self.paths[value])
             for path_index in range(num_paths):
                 path = self.paths[value][path_index]
+                step_stats = self.pathStats(run_stats, value, line, path_index)["Steps"]
                 lookup_output = ""
                 num_path_steps = len(path)
                 # Perform each file lookup (step) along the path
                 for step_index in range(num_path_steps):
                     file = self.files[path[step_index]]
                     key_col, val_col = file.key_val_pair
-                    key_list, val_list = file.key_val_list
                     standard_key, standard_val = self.standard_name_dict[key_col], self.standard_name_dict[val_col]
                     # Use previous step's lookup output as key (if it's there)
                     key = lookup_output or str(lookup_df.loc[i, standard_key]).upper()
 
                     # <= SEARCH VALUE COLUMN =>
-                    try:
-                        val_index = val_list.index(key)
+                    if file.searchVal(key):
                         lookup_output = key
                         if file.updatable or step_index + 1 < num_path_steps:
                             lookup_df.loc[i, standard_val] = lookup_output
-                    except ValueError:
+                        step_stats[step_index]["ENF" if lookup_output in ["ENF", "ZZ"] else "Hit"] += 1
+                    else:
 
                         # <= SEARCH KEY COLUMN =>
-                        try:
-                            key_index = key_list.index(key)
-                            lookup_output = val_list[key_index]
+                        key_output = file.searchKey(key)
+                        if key_output is not None:
+                            lookup_output = key_output
                             if file.updatable or step_index + 1 < num_path_steps:
                                 lookup_df.loc[i, standard_val] = lookup_output
-                        except ValueError:
+                            step_stats[step_index]["ENF" if lookup_output in ["ENF", "ZZ"] else "Hit"] += 1
+                        else:
+                            step_stats[step_index]["Miss"] += 1
 
                             # <= ONTO NEXT PATH =>
                             # Determine lookup flag
@@ -103,17 +121,102 @@ class LookupHelper:
                 # Break once we have an output
                 if lookup_output and lookup_output not in ["ENF", "ZZ"]:
                     lookup_df.loc[i, value] = lookup_output
+                    self.pathStats(run_stats, value, line, path_index)["Resolved"] += 1
                     break
             # Save whatever flags were raised
             if lookup_flag:
                 lookup_df.loc[i, 'Lookup Flag'] = lookup_flag
 
+        # <= PERSIST PATH STATISTICS =>
+        self.savePathStats(run_stats)
+
         # <= UPDATE LOOKUP FILES AUTOMATICALLY FOR IMPROVEMENT =>
-        for file_number in files_enf:
-            self.updateLookupFile(lookup_df, file_number)
+        if update_files:
+            for file_number in files_enf:
+                self.updateLookupFile(lookup_df, file_number)
 
         return lookup_df
 
+    def lineStats(self, stats, value, line):
+        return stats.setdefault(value, {}).setdefault(line, {"Rows": 0, "Paths": {}})
+
+    def pathStats(self, stats, value, line, path_index):
+        path = self.paths[value][path_index]
+        path_name = "@".join(str(n) for n in path)
+        path_stats = self.lineStats(stats, value, line)["Paths"].get(str(path_index))
+        # Start over if the Lookup Matrix path has changed
+        if path_stats is None or path_stats["Path"] != path_name:
+            path_stats = {"Path": path_name, "Resolved": 0,
+                          "Steps": [{"Hit": 0, "Miss": 0, "ENF": 0} for _ in path]}
+            self.lineStats(stats, value, line)["Paths"][str(path_index)] = path_stats
+        return path_stats
+
+    def loadPathStats(self):
+        """ Load path hit statistics from previous runs
+        :return: (dict) Value -> line -> path statistics
+        """
+        try:
+            with open(FileLoc.PATH_STATS.value, 'r') as stats_file:
+                return json.load(stats_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def savePathStats(self, run_stats):
+        """ Add this run's counts to the persisted path statistics
+        :param run_stats: Statistics for this run
+        :return: (void) write statistics file
+        """
+        with FileLock(FileLoc.PATH_STATS.value):
+            # Reload, so we keep counts from other operators
+            self.path_stats = self.loadPathStats()
+            for value, lines in run_stats.items():
+                for line, line_stats in lines.items():
+                    self.lineStats(self.path_stats, value, line)["Rows"] += line_stats["Rows"]
+                    for path_index, run_path_stats in line_stats["Paths"].items():
+                        path_stats = self.pathStats(self.path_stats, value, line, int(path_index))
+                        path_stats["Resolved"] += run_path_stats["Resolved"]
+                        for step_stats, run_step_stats in zip(path_stats["Steps"], run_path_stats["Steps"]):
+                            for outcome, count in run_step_stats.items():
+                                step_stats[outcome] += count
+            temp_path = FileLoc.PATH_STATS.value + ".tmp"
+            with open(temp_path, 'w') as stats_file:
+                json.dump(self.path_stats, stats_file, indent=1)
+            os.replace(temp_path, FileLoc.PATH_STATS.value)
+
+    def printPathReport(self):
+        """ Print hit, miss and ENF rates for every path, and the
+            lookup files which never resolve anything
+        :return: (void) print report
+        """
+        probes = {number: 0 for number in self.files}
+        hits = {number: 0 for number in self.files}
+        for value, lines in self.path_stats.items():
+            if value not in self.paths:
+                continue
+            for line, line_stats in lines.items():
+                print(f"> {value} / {line or '<No Line>'}: {line_stats['Rows']:,} rows")
+                for path_index, path in enumerate(self.paths[value]):
+                    path_stats = line_stats["Paths"].get(str(path_index))
+                    if path_stats is None or path_stats["Path"] != "@".join(str(n) for n in path):
+                        continue
+                    print(f"    Path {path_index + 1}: resolved"
+                          f" {path_stats['Resolved'] / max(line_stats['Rows'], 1):.1%} of rows")
+                    for number, step_stats in zip(path, path_stats["Steps"]):
+                        total = sum(step_stats.values())
+                        probes[number] += total
+                        hits[number] += step_stats["Hit"]
+                        print(f"      {self.files[number].name}:"
+                              f" hit {step_stats['Hit'] / max(total, 1):.1%},"
+                              f" miss {step_stats['Miss'] / max(total, 1):.1%},"
+                              f" ENF {step_stats['ENF'] / max(total, 1):.1%}")
+
+        # <= REPORT DEAD WEIGHT LOOKUP FILES =>
+        for number, file in self.files.items():
+            if probes[number] == 0:
+                print(f"> Dead weight: {file.name} has never been searched.")
+            elif hits[number] == 0:
+                print(f"> Dead weight: {file.name} never hit in {probes[number]:,} searches.")
+
     def updateLookupFile(self, lookup_df, number):
         """ Add new keys and replace invalid values
         :param lookup_df: Standardized dataframe
@@ -121,17 +224,67 @@ class LookupHelper:
         :return: (void) update and open file
         """
         file = self.files[number]
+        columns = file.id_columns + file.key_val_pair
+        # Get column widths from field mappings
+        fields = self.standardize_helper.field_mappings[columns]
+        column_widths = list(fields.iloc[0])
+
+        # <= DEFER TO THE RUN'S EXPORT STAGE =>
+        if self.export_helper is not None:
+            self.export_helper.addFile(file.path,
+                                       sheets=['Lookup'],
+                                       widths=[column_widths],
+                                       twin=Settings.TWIN_FORMAT.value,
+                                       prepare=lambda: [self.mergeLookupFile(lookup_df, number)])
+            return
+
+        # <= HOLD LOCK WHILE MERGING INTO THE FILE ON DISK =>
+        file_lock = FileLock(file.path)
+        try:
+            file_lock.acquire()
+        except TimeoutError as e:
+            print(f"> Could not update {file.name}. {e}.")
+            return
+        try:
+            merged_df = self.mergeLookupFile(lookup_df, number)
+
+            # <= EXPORT UPDATED FILE =>
+            output_filepath = self.excel_helper.createFile(file.path,
+                                                           dfs=[merged_df],
+                                                           sheets=['Lookup'],
+                                                           widths=[column_widths],
+                                                           twin=Settings.TWIN_FORMAT.value)
+        finally:
+            file_lock.release()
+        self.excel_helper.openFile(output_filepath)
+
+    def mergeLookupFile(self, lookup_df, number):
+        """ Merge new keys and invalid values into the lookup file on disk.
+            This is the only place a lookup file's full dataframe is
+            materialized. The caller must hold the file's lock
+        :param lookup_df: Standardized dataframe
+        :param number: File number
+        :return: (dataframe) Updated lookup file
+        """
+        file = self.files[number]
         key_col, val_col = file.key_val_pair
         columns = file.id_columns + file.key_val_pair
         id_vals = list(lookup_df[file.id_columns].iloc[0])
 
+        # <= RELOAD FILE IN CASE ANOTHER OPERATOR UPDATED IT =>
+        lookup_file_df = self.excel_helper.readFile(file.path, 'Lookup')
+        current_keys = set(lookup_file_df[key_col].astype(str).str.upper())
+
         # <= CHANGE INVALID VALS =>
         for invalid_val in file.invalid_vals:
-            file.df[val_col] = file.df[val_col].replace(invalid_val, 'ENF')
+            lookup_file_df[val_col] = lookup_file_df[val_col].replace(invalid_val, 'ENF')
 
         # <= APPEND NEW KEYS =>
         append_df = pd.DataFrame(columns=columns)
         for new_key in file.new_keys:
+            # Never overwrite a key another operator has added meanwhile
+            if new_key in current_keys:
+                continue
             new_row = id_vals + [new_key, 'ENF']
             append_df.loc[len(append_df)] = new_row
         append_df.drop_duplicates(subset=key_col,
@@ -139,11 +292,11 @@ class LookupHelper:
                                   ignore_index=True)
         append_df = append_df.reset_index(drop=True)
         # Append to file
-        file.df = pd.concat([file.df, append_df])
-        file.df = file.df.drop_duplicates(subset=key_col,
-                                          keep='last',
-                                          ignore_index=True)
-        file.df = file.df.reset_index(drop=True)
+        lookup_file_df = pd.concat([lookup_file_df, append_df])
+        lookup_file_df = lookup_file_df.drop_duplicates(subset=key_col,
+                                                        keep='last',
+                                                        ignore_index=True)
+        lookup_file_df = lookup_file_df.reset_index(drop=True)
 
         # <= SORT FILE ROWS =>
         # Custom sort function: Place 'ENF' on top, everything else is sorted regularly
@@ -151,34 +304,66 @@ class LookupHelper:
         # Sort by the custom key
         sort_by = ['Upload Timestamp', val_col] if 'Upload Timestamp' in file.id_columns else val_col
         ascending = [False, True] if 'Upload Timestamp' in file.id_columns else True
-        file.df = file.df.sort_values(by=sort_by,
-                                      ascending=ascending,
-                                      ignore_index=True,
-                                      key=lambda col: col.map(sortEnfOnTop)
-                                      if col.name == val_col else col)
-        file.df = file.df.reset_index(drop=True)
-
-        # <= EXPORT UPDATED FILE =>
-        # Get column widths from field mappings
-        fields = self.standardize_helper.field_mappings[columns]
-        column_widths = list(fields.iloc[0])
-        output_filepath = self.excel_helper.createFile(file.path,
-                                                       dfs=[file.df],
-                                                       sheets=['Lookup'],
-                                                       widths=[column_widths])
-        self.excel_helper.openFile(output_filepath)
+        lookup_file_df = lookup_file_df.sort_values(by=sort_by,
+                                                    ascending=ascending,
+                                                    ignore_index=True,
+                                                    key=lambda col: col.map(sortEnfOnTop)
+                                                    if col.name == val_col else col)
+        lookup_file_df = lookup_file_df.reset_index(drop=True)
+
+        return lookup_file_df
+
+class StringPool:
+    """Interns lookup strings once, shared by every lookup file"""
+
+    __slots__ = ['codes', 'strings']
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def encode(self, series):
+        """ Dictionary-encode a column of strings
+        :param series: Column of strings
+        :return: (array) int32 code per row
+        """
+        # readFile fills blanks with "", but never let factorize's -1 for NA alias the last string
+        row_codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        pool_codes = np.empty(len(uniques), dtype=np.int32)
+        for i, string in enumerate(uniques):
+            code = self.codes.get(string)
+            if code is None:
+                code = len(self.strings)
+                self.codes[string] = code
+                self.strings.append(string)
+            pool_codes[i] = code
+        return pool_codes[row_codes]
 
 class File:
 
-    def __init__(self, files, number):
+    __slots__ = ['number', 'name', 'path', 'updatable', 'key_val_pair', 'lookup_flag', 'id_columns',
+                 'new_keys', 'invalid_vals', 'string_pool', 'key_codes', 'key_vals', 'val_codes']
+
+    def __init__(self, files, number, excel_helper, string_pool, load=True):
         self.number = number
         self.name = files.loc[number, 'Name']
         self.path = FileLoc.LOOKUP.value + self.name
-        self.df = pd.read_excel(self.path, sheet_name=0).fillna("")
         self.updatable = files.loc[number, 'Updatable']
         self.key_val_pair = files.loc[number, 'Key-Value Pair'].split(sep="@")
-        self.key_val_list = [self.df[self.key_val_pair[0]].astype(str).str.upper().tolist(),
-                             self.df[self.key_val_pair[1]].astype(str).str.upper().tolist()]
+        # Clients of the lookup server only need the file definition
+        self.string_pool = string_pool
+        self.key_codes = None
+        self.key_vals = None
+        self.val_codes = None
+        if load:
+            # <= ENCODE KEY AND VALUE COLUMNS, THEN DROP THE DATAFRAME =>
+            df = excel_helper.readFile(self.path, 'Lookup', use_twin=True)
+            all_key_codes = string_pool.encode(df[self.key_val_pair[0]].astype(str).str.upper())
+            all_val_codes = string_pool.encode(df[self.key_val_pair[1]].astype(str).str.upper())
+            # Sorted unique keys, each with the value of its first row (like list.index)
+            self.key_codes, first_rows = np.unique(all_key_codes, return_index=True)
+            self.key_vals = all_val_codes[first_rows]
+            self.val_codes = np.unique(all_val_codes)
         self.lookup_flag = files.loc[number, 'Lookup Flag']
         try:
             self.id_columns = files.loc[number, 'ID Columns'].split(sep="@")
@@ -187,5 +372,39 @@ class File:
         self.new_keys = []
         self.invalid_vals = []
 
+    def searchVal(self, val):
+        """ Whether a string is in the value column
+        :param val: Upper-cased string
+        :return: (boolean) Whether the value was found
+        """
+        code = self.string_pool.codes.get(val)
+        if code is None:
+            return False
+        i = np.searchsorted(self.val_codes, code)
+        return i < len(self.val_codes) and self.val_codes[i] == code
 
+    def searchKey(self, key):
+        """ Find the value for a string in the key column
+        :param key: Upper-cased string
+        :return: (string) Value of the key's first row, or None if not found
+        """
+        code = self.string_pool.codes.get(key)
+        if code is None:
+            return None
+        i = np.searchsorted(self.key_codes, code)
+        if i < len(self.key_codes) and self.key_codes[i] == code:
+            return self.string_pool.strings[self.key_vals[i]]
+        return None
 
+    def keyValMap(self):
+        """ Decode the key column to a dict of key to first value
+        :return: (dict) Key mapped to value
+        """
+        strings = self.string_pool.strings
+        return {strings[key]: strings[val] for key, val in zip(self.key_codes, self.key_vals)}
+
+    def valSet(self):
+        """ Decode the value column to a set
+        :return: (set) Values
+        """
+        return {self.string_pool.strings[val] for val in self.val_codes}
@@ -0,0 +1,254 @@
+import os
+import json
+import secrets
+import pandas as pd
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from GlobalVariables import FileLoc
+from LookupHelper import LookupHelper
+
+# Address and authkey of the running server, readable only by the user who
+# started it (user profiles on Windows are private to their owner)
+SERVER_INFO_DIR = os.path.join(os.path.expanduser("~"), ".h2_commissions")
+SERVER_INFO_PATH = os.path.join(SERVER_INFO_DIR, "Lookup Server.json")
+# Errors which mean the server can't be reached or trusted
+CONNECTION_ERRORS = (OSError, EOFError, AuthenticationError, ValueError, KeyError)
+
+def sendMessage(conn, message):
+    """ Send a message as JSON, so neither side ever unpickles data
+    :param conn: Connection to send on
+    :param message: (dict) JSON-serializable message
+    :return: (void) send message
+    """
+    conn.send_bytes(json.dumps(message).encode())
+
+def receiveMessage(conn):
+    """ Receive a JSON message
+    :param conn: Connection to receive on
+    :return: (dict) Message
+    """
+    return json.loads(conn.recv_bytes().decode())
+
+def loadServerInfo():
+    """ Find the lookup server started by this user
+    :return: (dict) "Address" and "Authkey", or None if no server was started
+    """
+    try:
+        with open(SERVER_INFO_PATH, 'r') as info_file:
+            info = json.load(info_file)
+        return {"Address": ('localhost', info["Port"]), "Authkey": bytes.fromhex(info["Authkey"])}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def connect(server_info):
+    """ Open an authenticated connection to the lookup server
+    :param server_info: (dict) From loadServerInfo
+    :return: Connection
+    """
+    if server_info is None:
+        raise ConnectionRefusedError("lookup server is not running")
+    return Client(server_info["Address"], authkey=server_info["Authkey"])
+
+class LookupServer:
+    """Long-lived process which holds the lookup tables for every client"""
+
+    def __init__(self):
+        self.lookup_helper = None
+        self.lookup_mtimes = None
+        self.reloadLookups()
+
+    def lookupMtimes(self):
+        """ Modified times of the Lookup Matrix and every value lookup file
+        :return: (list) Modified times, in a fixed order
+        """
+        filepaths = [FileLoc.LOOKUP_MATRIX.value] + [file.path for file in self.lookup_helper.files.values()]
+        return [os.path.getmtime(filepath) for filepath in filepaths]
+
+    def reloadLookups(self):
+        """ Load (or hot-reload) all lookup tables
+        :return: (void) replace lookup helper
+        """
+        print("..Loading lookup files..")
+        self.lookup_helper = LookupHelper()
+        self.lookup_mtimes = self.lookupMtimes()
+        print(f"> Loaded {len(self.lookup_helper.files)} lookup files.")
+
+    def resolve(self, columns, rows, value):
+        """ Resolve a batch of rows through the lookup paths, leaving
+            lookup file updates to the client
+        :param columns: Names of the columns sent
+        :param rows: Row values, as the strings lookups compare
+        :param value: Name of column which we perform lookup for
+        :return: (dict) Cells the lookup wrote and the ENF updates per file
+        """
+        # <= HOT-RELOAD IF ANY LOOKUP FILE CHANGED =>
+        if self.lookupMtimes() != self.lookup_mtimes:
+            self.reloadLookups()
+
+        # <= PERFORM LOOKUP WITHOUT WRITING FILES =>
+        for file in self.lookup_helper.files.values():
+            file.new_keys = []
+            file.invalid_vals = []
+        standard_df = pd.DataFrame(rows, columns=columns, dtype=object)
+        original_df = standard_df.copy()
+        lookup_df = self.lookup_helper.performLookup(standard_df, value, update_files=False)
+
+        # <= SEND BACK ONLY THE CELLS THE LOOKUP WROTE =>
+        cells = []
+        for column in lookup_df.columns:
+            before = original_df[column] if column in original_df.columns else None
+            for position, cell in enumerate(lookup_df[column]):
+                if isinstance(cell, str) and (before is None or cell != before.iat[position]):
+                    cells.append([position, column, cell])
+        updates = [[int(file.number), file.new_keys, file.invalid_vals]
+                   for file in self.lookup_helper.files.values()
+                   if file.new_keys or file.invalid_vals]
+
+        return {"Cells": cells, "Updates": updates}
+
+    def handleRequest(self, request):
+        """ Answer one client request
+        :param request: (dict) Client request
+        :return: (dict) Response to send back
+        """
+        try:
+            if request["Request"] == "Resolve":
+                print(f"..Resolving {len(request['Rows'])} rows..")
+                return self.resolve(request["Columns"], request["Rows"], request["Value"])
+            return {}
+        except Exception as e:
+            print(f"> Lookup request failed: {e}")
+            return {"Error": str(e)}
+
+    def writeServerInfo(self, port, authkey):
+        """ Share the server's port and authkey with this user's clients only
+        :param port: Port the server listens on
+        :param authkey: Random key clients must authenticate with
+        :return: (void) write server info file
+        """
+        os.makedirs(SERVER_INFO_DIR, mode=0o700, exist_ok=True)
+        temp_path = SERVER_INFO_PATH + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        # Created owner-only, so the key is never readable by anyone else
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as info_file:
+            json.dump({"Port": port, "Authkey": authkey.hex()}, info_file)
+        os.replace(temp_path, SERVER_INFO_PATH)
+
+    def serve(self):
+        """ Serve lookup requests until asked to stop
+        :return: (void) run server
+        """
+        # A fresh key each start, so old or leaked keys are useless
+        authkey = secrets.token_bytes(32)
+        with Listener(('localhost', 0), authkey=authkey) as listener:
+            port = listener.address[1]
+            self.writeServerInfo(port, authkey)
+            print(f"> Lookup server listening on localhost:{port}")
+            try:
+                while True:
+                    try:
+                        with listener.accept() as conn:
+                            request = receiveMessage(conn)
+                            if request["Request"] == "Stop":
+                                sendMessage(conn, {})
+                                break
+                            sendMessage(conn, self.handleRequest(request))
+                    except Exception as e:  # Bad client, keep serving everyone else
+                        print(f"> Lookup connection failed: {e}")
+            finally:
+                if loadServerInfo() == {"Address": ('localhost', port), "Authkey": authkey}:
+                    os.remove(SERVER_INFO_PATH)
+        print("> Lookup server stopped.")
+
+class LookupClient(LookupHelper):
+    """Lookup helper which resolves rows through the lookup server"""
+
+    def __init__(self, server_info):
+        # Only load file definitions, the server holds the tables
+        super().__init__(load_files=False)
+        self.server_info = server_info
+        self.local_helper = None
+
+    def request(self, request):
+        """ Send one request to the lookup server
+        :param request: (dict) Request to send
+        :return: (dict) Server response
+        """
+        with connect(self.server_info) as conn:
+            sendMessage(conn, request)
+            response = receiveMessage(conn)
+        if "Error" in response:
+            raise ConnectionError(response["Error"])
+        return response
+
+    def lookupColumns(self, standard_df, value):
+        """ Columns the lookup paths read or write
+        :param standard_df: Standardized columns
+        :param value: Name of column which we perform lookup for
+        :return: (list) Column names present in the dataframe
+        """
+        columns = {'Line', 'Lookup Flag', value}
+        for file in self.files.values():
+            columns.update(self.standard_name_dict[col] for col in file.key_val_pair)
+        return [column for column in standard_df.columns if column in columns]
+
+    def performLookup(self, standard_df, value, update_files=True):
+        """ Resolve rows on the lookup server, then update
+            lookup files from this process
+        :param standard_df: Standardized columns
+        :param value: Name of column which we perform lookup for
+        :param update_files: Whether to write ENF entries back to lookup files
+        :return: Standardized, preprocessed, generated DF
+                 with lookup value populated
+        """
+        # Lookups compare cells as strings, so only send strings
+        columns = self.lookupColumns(standard_df, value)
+        rows = [list(row) for row in zip(*[standard_df[column].map(str) for column in columns])]
+        try:
+            response = self.request({"Request": "Resolve", "Columns": columns,
+                                     "Rows": rows, "Value": value})
+        except CONNECTION_ERRORS as e:
+            # <= FALL BACK TO IN-PROCESS LOOKUP =>
+            print(f"> Lookup server unavailable ({e}), loading lookup files locally.")
+            if self.local_helper is None:
+                self.local_helper = LookupHelper()
+                self.local_helper.setStandardizeHelper(self.standardize_helper)
+                self.local_helper.setExcelHelper(self.excel_helper)
+                self.local_helper.setExportHelper(self.export_helper)
+            return self.local_helper.performLookup(standard_df, value, update_files)
+
+        # <= APPLY THE CELLS THE LOOKUP WROTE =>
+        lookup_df = standard_df
+        for position, column, cell in response["Cells"]:
+            lookup_df.loc[lookup_df.index[position], column] = cell
+
+        # <= UPDATE LOOKUP FILES AUTOMATICALLY FOR IMPROVEMENT =>
+        if update_files:
+            for number, new_keys, invalid_vals in response["Updates"]:
+                self.files[number].new_keys = new_keys
+                self.files[number].invalid_vals = invalid_vals
+                self.updateLookupFile(lookup_df, number)
+
+        return lookup_df
+
+def getLookupHelper():
+    """ Use this user's lookup server when it is running, otherwise
+        load the lookup files in this process
+    :return: LookupClient or LookupHelper
+    """
+    server_info = loadServerInfo()
+    try:
+        with connect(server_info) as conn:
+            sendMessage(conn, {"Request": "Ping"})
+            receiveMessage(conn)
+    except CONNECTION_ERRORS:
+        return LookupHelper()
+    print("> Using lookup server.")
+    return LookupClient(server_info)
+
+
+if __name__ == "__main__":
+    LookupServer().serve()
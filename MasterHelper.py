@@ -0,0 +1,102 @@
+import os
+import pandas as pd
+
+from GlobalVariables import FileLoc, Settings
+from LockHelper import FileLock, JournalHelper
+from RecodeHelper import RecodeHelper
+
+# Times to merge again when the master changes during an add to master
+MAX_MERGE_RETRIES = 3
+
+class MasterHelper:
+
+    def __init__(self, excel_helper):
+        self.excel_helper = excel_helper
+        self.journal_helper = JournalHelper(FileLoc.MASTER_JOURNAL.value)
+
+    def removeFileRows(self, master_df, input_df):
+        """ Clear out any master rows with the same Line/File Date as the input
+        :param master_df: Commissions master dataframe
+        :param input_df: FSE-assigned input dataframe
+        :return: (dataframe) Master without the input's previous data
+        """
+        unique_id_cols = ['Line', 'File Date']
+        file_unique_id = list(input_df[unique_id_cols].iloc[0])
+        # Create a condition that identifies rows to remove
+        condition = pd.Series([True] * len(master_df), dtype=bool, index=master_df.index)
+        for col, val in zip(unique_id_cols, file_unique_id):
+            condition = condition & (master_df[col] == val)
+        # Remove rows where condition is True
+        master_df = master_df[~condition]
+        print(f"> Removed previous {'@'.join(file_unique_id)}"
+              f" data from master file.")
+        return master_df
+
+    def addToMaster(self, input_df, column_widths, retries=MAX_MERGE_RETRIES):
+        """ Queue the input in the master journal, merge every queued
+            append into a new master, then swap it in under the master lock
+        :param input_df: FSE-assigned input dataframe
+        :param column_widths: Master column widths
+        :param retries: Times to merge again if the master changes meanwhile
+        :return: (string) Master filepath, or "" if not written
+        """
+        # <= QUEUE APPEND IN WRITE-AHEAD JOURNAL =>
+        entry_path = self.journal_helper.append(input_df)
+
+        for _ in range(retries + 1):
+
+            # <= MERGE ALL QUEUED APPENDS OUTSIDE THE LOCK =>
+            master_mtime = os.path.getmtime(FileLoc.MASTER.value)
+            entries = self.journal_helper.pendingEntries()
+            if entry_path not in [path for path, _ in entries]:
+                print("> Input was already merged into the master by another operator.")
+                return FileLoc.MASTER.value
+            self.excel_helper.backupFile(FileLoc.MASTER.value)
+            master_df = self.excel_helper.readFile(FileLoc.MASTER.value, 'Data')
+            for _, entry_df in entries:
+                master_df = self.removeFileRows(master_df, entry_df)
+                master_df = pd.concat([entry_df, master_df])
+            if len(entries) > 1:
+                print(f"> Merged {len(entries) - 1} queued appends from other operators.")
+            master_df = master_df.sort_values(by=['Upload Timestamp', 'Reported Customer'],
+                                              ascending=[False, True],
+                                              ignore_index=True)
+            master_df = master_df.reset_index(drop=True)
+
+            # <= BUILD MASTER FILE OUTSIDE THE LOCK =>
+            print(f"..Creating {os.path.basename(FileLoc.MASTER.value)}..")
+            temp_files = self.excel_helper.buildFile(os.path.abspath(FileLoc.MASTER.value),
+                                                     dfs=[master_df],
+                                                     sheets=["Data"],
+                                                     widths=[column_widths],
+                                                     twin=Settings.TWIN_FORMAT.value)
+
+            # <= SWAP IN THE NEW MASTER UNDER LOCK =>
+            try:
+                with FileLock(FileLoc.MASTER.value):
+                    # Only write if nobody else changed the master while we merged
+                    if os.path.getmtime(FileLoc.MASTER.value) != master_mtime:
+                        self.excel_helper.discardFiles(temp_files)
+                        print("> Master was changed by another operator, merging again.")
+                        continue
+                    if self.excel_helper.commitFiles(temp_files):
+                        # Added rows were coded by an unknown lookup state, so re-code them in full
+                        RecodeHelper.resetPartitions(set().union(*[RecodeHelper.partitionKeys(entry_df)
+                                                                   for _, entry_df in entries]))
+                        self.journal_helper.clearEntries([path for path, _ in entries])
+                        print(f"> New file saved at: {os.path.abspath(FileLoc.MASTER.value)}")
+                        return FileLoc.MASTER.value
+            except TimeoutError as e:
+                self.excel_helper.discardFiles(temp_files)
+                print(f"> Add to master queued but not merged. {e}."
+                      f" It will be merged by the next add to master.")
+                return ""
+            print(f"> Could not save {os.path.basename(FileLoc.MASTER.value)}, the file is currently"
+                  f" open in Excel! Please close the file and try again.")
+            # Don't leave our failed append queued for someone else
+            self.journal_helper.clearEntries([entry_path])
+            return ""
+
+        print("> Master keeps being changed by other operators. Add to master queued but not merged,"
+              " it will be merged by the next add to master.")
+        return ""
@@ -0,0 +1,277 @@
+import os
+import json
+import pandas as pd
+
+from FingerprintHelper import FingerprintHelper
+from GlobalVariables import FileLoc, Settings
+from LockHelper import FileLock
+
+# Times to re-code again when the master changes during a re-code
+MAX_RECODE_RETRIES = 3
+
+class RecodeHelper:
+
+    def __init__(self, lookup_helper, excel_helper):
+        self.lookup_helper = lookup_helper
+        self.excel_helper = excel_helper
+        # Lookup state which was last applied to each master partition
+        self.applied_lookups = self.loadAppliedLookups()
+        self.master_index = {}
+
+    @staticmethod
+    def partitionKeys(df):
+        """ Label each row with its Line@File Date partition
+        :param df: Master or FSE-assigned dataframe
+        :return: (series) Partition of each row
+        """
+        return df['Line'].astype(str) + "@" + df['File Date'].astype(str)
+
+    @staticmethod
+    def loadAppliedLookups():
+        """ Load the lookup state last applied to each master partition
+        :return: (dict) "Snapshots" maps a state key to its Lookup Matrix
+                 hash and lookups, "Partitions" maps a partition to its
+                 state key (None, or not listed, if never re-coded)
+        """
+        try:
+            with open(FileLoc.APPLIED_LOOKUPS.value, 'r') as applied_file:
+                return json.load(applied_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"Snapshots": {}, "Partitions": {}}
+
+    @staticmethod
+    def saveAppliedLookups(applied):
+        """ Write the applied lookup state, dropping unused snapshots.
+            The caller must hold the master lock
+        :param applied: (dict) Applied lookup state
+        :return: (void) write applied lookups file
+        """
+        used_keys = set(applied["Partitions"].values())
+        applied["Snapshots"] = {key: snapshot for key, snapshot in applied["Snapshots"].items()
+                                if key in used_keys}
+        temp_path = FileLoc.APPLIED_LOOKUPS.value + ".tmp"
+        with open(temp_path, 'w') as applied_file:
+            json.dump(applied, applied_file)
+        os.replace(temp_path, FileLoc.APPLIED_LOOKUPS.value)
+
+    @staticmethod
+    def resetPartitions(partitions):
+        """ Mark partitions as coded by an unknown lookup state, so the
+            next re-code re-runs all of their rows. The caller must hold
+            the master lock
+        :param partitions: Partitions which were added to the master
+        :return: (void) write applied lookups file
+        """
+        applied = RecodeHelper.loadAppliedLookups()
+        for partition in partitions:
+            applied["Partitions"][partition] = None
+        RecodeHelper.saveAppliedLookups(applied)
+
+    def currentLookups(self):
+        """ Capture the key and value columns of every lookup file
+        :return: (dict) File name mapped to its [key_val_map, val_list]
+        """
+        return {file.name: [file.keyValMap(), sorted(file.valSet())]
+                for file in self.lookup_helper.files.values()}
+
+    def currentStateKey(self):
+        """ Identify the current lookup state by the content of its files
+        :return: (string) State key
+        """
+        filepaths = [FileLoc.LOOKUP_MATRIX.value] + [file.path for file in self.lookup_helper.files.values()]
+        return FingerprintHelper().fingerprint(filepaths)
+
+    def matrixHash(self):
+        """ Identify the current lookup paths and column names
+        :return: (string) Content hash of the Lookup Matrix
+        """
+        return FingerprintHelper().hashFile(FileLoc.LOOKUP_MATRIX.value)
+
+    def recordAppliedLookups(self, partitions, state_key):
+        """ Record the current lookup state as applied to every master
+            partition. The caller must hold the master lock
+        :param partitions: Every partition in the master
+        :param state_key: Key of the current lookup state
+        :return: (void) write applied lookups file
+        """
+        applied = self.loadAppliedLookups()
+        applied["Snapshots"][state_key] = {"Matrix": self.matrixHash(),
+                                           "Lookups": self.currentLookups()}
+        applied["Partitions"] = {partition: state_key for partition in partitions}
+        self.saveAppliedLookups(applied)
+        self.applied_lookups = applied
+
+    def diffLookup(self, old_lists, new_lists):
+        """ Find every key and value whose lookup result may have changed
+        :param old_lists: [key_val_map, val_set] last applied
+        :param new_lists: [key_val_map, val_set] currently in the file
+        :return: (set) Changed keys and values
+        """
+        old_map, old_vals = old_lists
+        new_map, new_vals = new_lists
+
+        # <= COMPARE KEYS AND VALUES =>
+        changed_keys = {key for key in old_map.keys() | new_map.keys()
+                        if old_map.get(key) != new_map.get(key)}
+        changed_vals = old_vals ^ new_vals
+
+        return changed_keys | changed_vals
+
+    def changedLookups(self, old_lookups):
+        """ Diff every lookup file against an applied version
+        :param old_lookups: File name mapped to its applied [key_val_map, val_list]
+        :return: (dict) File number mapped to its set of changed keys and values
+        """
+        changed = {}
+        for number, file in self.lookup_helper.files.items():
+            new_lists = [file.keyValMap(), file.valSet()]
+            old_map, old_vals = old_lookups.get(file.name, [{}, []])
+            changed_entries = self.diffLookup([old_map, set(old_vals)], new_lists)
+            if changed_entries:
+                changed[number] = changed_entries
+        return changed
+
+    def indexColumn(self, master_df, column):
+        """ Build (or reuse) an index from column values to master rows
+        :param master_df: Commissions master dataframe
+        :param column: Standard column name to index
+        :return: (dict) Upper-cased value mapped to master row labels
+        """
+        if column not in self.master_index:
+            keys = master_df[column].astype(str).str.upper()
+            self.master_index[column] = keys.groupby(keys).groups
+        return self.master_index[column]
+
+    def affectedRows(self, master_df, changed):
+        """ Use the key index to find master rows touched by lookup changes
+        :param master_df: Commissions master dataframe
+        :param changed: File number mapped to its changed keys and values
+        :return: (list) Master row labels which need re-coding
+        """
+        rows = set()
+        for number, entries in changed.items():
+            file = self.lookup_helper.files[number]
+            for col in file.key_val_pair:
+                standard_col = self.lookup_helper.standard_name_dict[col]
+                if standard_col not in master_df.columns:
+                    continue
+                index = self.indexColumn(master_df, standard_col)
+                for entry in entries:
+                    rows.update(index.get(entry, []))
+        return sorted(rows)
+
+    def staleRows(self, master_df, partitions, state_key):
+        """ Find master rows which may be coded differently by the current
+            lookup state than by the state applied to their partition
+        :param master_df: Commissions master dataframe
+        :param partitions: Partition of each master row
+        :param state_key: Key of the current lookup state
+        :return: (list) Master row labels which need re-coding, or
+                 None if every partition has the current state
+        """
+        applied = self.applied_lookups
+        matrix_hash = self.matrixHash()
+        rows = set()
+        affected = {}
+        up_to_date = True
+        for partition, partition_rows in partitions.groupby(partitions).groups.items():
+            applied_key = applied["Partitions"].get(partition)
+            if applied_key == state_key:
+                continue
+            up_to_date = False
+            if applied_key not in applied["Snapshots"]:
+                print(f"> {partition}: no applied lookup state found, re-coding all rows.")
+                rows.update(partition_rows)
+                continue
+            # Changed paths or columns can change any row, not just changed keys
+            if applied["Snapshots"][applied_key]["Matrix"] != matrix_hash:
+                print(f"> {partition}: Lookup Matrix changed, re-coding all rows.")
+                rows.update(partition_rows)
+                continue
+            # <= DIFF EACH APPLIED STATE ONCE, THEN KEEP THE PARTITION'S ROWS =>
+            if applied_key not in affected:
+                changed = self.changedLookups(applied["Snapshots"][applied_key]["Lookups"])
+                for number, entries in changed.items():
+                    print(f"> {self.lookup_helper.files[number].name}:"
+                          f" {len(entries)} changed entries")
+                affected[applied_key] = set(self.affectedRows(master_df, changed))
+            rows.update(affected[applied_key].intersection(partition_rows))
+        if up_to_date:
+            return None
+        return sorted(rows)
+
+    def recodeMaster(self, retries=MAX_RECODE_RETRIES):
+        """ Re-run lookups for master rows affected by changed lookup files
+        :param retries: Times to re-code again if the master changes meanwhile
+        :return: (int) Number of master rows which changed
+        """
+        # <= LOAD MASTER FILE =>
+        master_mtime = os.path.getmtime(FileLoc.MASTER.value)
+        master_df = self.excel_helper.readFile(FileLoc.MASTER.value, 'Data')
+        self.applied_lookups = self.loadAppliedLookups()
+        self.master_index = {}
+
+        # <= FIND AFFECTED MASTER ROWS =>
+        partitions = self.partitionKeys(master_df)
+        state_key = self.currentStateKey()
+        rows = self.staleRows(master_df, partitions, state_key)
+        if rows is None:
+            print("> No lookup files have changed since the last re-code.")
+            return 0
+        print(f"..Re-coding {len(rows)} of {len(master_df)} master rows..")
+
+        # <= RE-RUN AFFECTED ROWS THROUGH LOOKUP PATHS =>
+        recoded_df = master_df.loc[rows].copy()
+        recoded_df.loc[:, 'Lookup Flag'] = ""
+        for value in self.lookup_helper.paths:
+            if value not in recoded_df.columns:
+                continue
+            recoded_df.loc[:, value] = ""
+            recoded_df = self.lookup_helper.performLookup(recoded_df, value, update_files=False)
+        recoded_df = recoded_df[master_df.columns]
+
+        # <= KEEP ONLY ROWS WHOSE CODING CHANGED =>
+        original_df = master_df.loc[rows].astype(str)
+        changed_mask = (recoded_df.astype(str) != original_df).any(axis=1)
+        changed_df = recoded_df[changed_mask]
+        if changed_df.empty:
+            print("> Re-code complete. No master rows changed.")
+        else:
+            # Report changes by Line/File Date partition
+            changed_partitions = changed_df.groupby(['Line', 'File Date']).size()
+            for (line, filedate), count in changed_partitions.items():
+                print(f"> {line}@{filedate}: {count} rows re-coded")
+            master_df.loc[changed_df.index] = changed_df
+        field_mappings = pd.read_excel(FileLoc.FIELD_MAPPINGS.value, sheet_name=0).fillna("")
+        column_widths = list(field_mappings.iloc[0])
+
+        # <= WRITE CHANGED ROWS BACK AND RECORD APPLIED LOOKUP STATE =>
+        try:
+            with FileLock(FileLoc.MASTER.value):
+                # Only write if nobody else changed the master while we re-coded
+                master_changed = os.path.getmtime(FileLoc.MASTER.value) != master_mtime
+                if not master_changed:
+                    if not changed_df.empty:
+                        self.excel_helper.backupFile(FileLoc.MASTER.value)
+                        output_filepath = self.excel_helper.createFile(FileLoc.MASTER.value,
+                                                                       dfs=[master_df],
+                                                                       sheets=["Data"],
+                                                                       widths=[column_widths],
+                                                                       twin=Settings.TWIN_FORMAT.value)
+                        if not output_filepath:
+                            return 0
+                    self.recordAppliedLookups(partitions.unique(), state_key)
+        except TimeoutError as e:
+            print(f"> Could not re-code master. {e}.")
+            return 0
+        if master_changed:
+            if retries <= 0:
+                print("> Master keeps being changed by other operators. Please re-code again later.")
+                return 0
+            print("> Master was changed by another operator during re-code, re-coding again.")
+            return self.recodeMaster(retries - 1)
+
+        print(f"> {os.path.basename(FileLoc.MASTER.value)} re-coded,"
+              f" {len(changed_df)} rows changed.")
+
+        return len(changed_df)
@@ -4,6 +4,7 @@ pip install --user numpy==2.1.1
 pip install --user xlrd==2.0.1
 pip install --user openpyxl==3.1.5
 pip install --user xlsxwriter==3.2.0
+pip install --user pyarrow==17.0.0
 pip install --user pywin32==304
 pip install --user pywin32-ctypes==0.2.0
 pip install --user requests==2.32.2
@@ -0,0 +1 @@
+@py.exe LookupServer.py
\ No newline at end of file
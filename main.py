@@ -7,9 +7,15 @@ from PyQt5.uic import loadUi
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication, QDialog, QFileDialog, QMessageBox
 
+from DataViewer import DataViewer
 from ExcelHelper import ExcelHelper
-from GlobalVariables import FileLoc
+from ExportHelper import ExportHelper
+from FingerprintHelper import FingerprintHelper
+from GlobalVariables import FileLoc, Settings
 from LookupHelper import LookupHelper
+from LookupServer import getLookupHelper
+from MasterHelper import MasterHelper
+from RecodeHelper import RecodeHelper
 from StandardizeHelper import StandardizeHelper
 
 VERSION = "Alpha v0.1"
@@ -36,6 +42,8 @@ class MainWindow(QDialog):
         self.input_filename = ""
         self.input_df = None
         self.updated_lookup_files = {}
+        # Keep open viewer windows alive
+        self.viewers = []
         # Create custom output stream
         self.stream = Stream()
         self.stream.newText.connect(self.writeToConsole)
@@ -45,11 +53,16 @@ class MainWindow(QDialog):
         # Load external UI design w/ QtDesigner
         loadUi("H2 Commissions.ui", self)
         # Group elements for future ease of access
-        self.all_elements = [self.btn_select_file, self.btn_deselect_file,
-                             self.btn_assign_fse, self.btn_add_to_master, self.btn_clear_console]
-        self.file_selected_elements = [self.btn_deselect_file, self.btn_assign_fse, self.btn_add_to_master]
+        self.all_elements = [self.btn_select_file, self.btn_deselect_file, self.btn_assign_fse,
+                             self.btn_add_to_master, self.chk_force_rerun, self.btn_recode_master,
+                             self.btn_view_master, self.btn_view_file, self.btn_path_report,
+                             self.chk_open_excel, self.btn_clear_console]
+        self.file_selected_elements = [self.btn_deselect_file, self.btn_assign_fse,
+                                       self.btn_add_to_master, self.chk_force_rerun]
         self.file_deselected_elements = [self.btn_select_file]
-        self.file_either_elements = [self.btn_clear_console]
+        self.file_either_elements = [self.btn_recode_master, self.btn_view_master,
+                                     self.btn_view_file, self.btn_path_report, self.chk_open_excel,
+                                     self.btn_clear_console]
         self.lockButtons()
         self.unlockButtons()
         # Connect buttons to functions
@@ -58,6 +71,10 @@ class MainWindow(QDialog):
         self.btn_deselect_file.clicked.connect(self.deselectFile)
         self.btn_assign_fse.clicked.connect(self.assignFSE)
         self.btn_add_to_master.clicked.connect(self.addToMaster)
+        self.btn_recode_master.clicked.connect(self.recodeMaster)
+        self.btn_view_master.clicked.connect(self.viewMaster)
+        self.btn_view_file.clicked.connect(self.viewFile)
+        self.btn_path_report.clicked.connect(self.printPathReport)
 
         # Show welcome message
         self.clearConsole()
@@ -114,7 +131,7 @@ class MainWindow(QDialog):
 
             # <= LOAD FILE TO APP =>
             # Convert selected file to dataframe
-            self.input_df = pd.read_excel(self.input_filepath, sheet_name=0).fillna("")
+            self.input_df = ExcelHelper().readFile(self.input_filepath, 'Data')
 
             # <= UPDATE USER WITH STATUS =>
             # Print out the selected filename
@@ -141,10 +158,42 @@ class MainWindow(QDialog):
         [e.setEnabled(True) for e in self.file_deselected_elements]
         [e.setEnabled(True) for e in self.file_either_elements]
 
+    def viewMaster(self):
+        """View commissions master in the in-app viewer"""
+        if not os.path.exists(FileLoc.MASTER.value):
+            print("> Cannot view master. Master file cannot be found.")
+        else:
+            self.showViewer(FileLoc.MASTER.value)
+
+    def viewFile(self):
+        """View an output file in the in-app viewer"""
+        filepath, _ = QFileDialog.getOpenFileName(self, directory=FileLoc.OUTPUT.value,
+                                                  filter="Excel files (*.xls *.xlsx *.xlsm)")
+        if not filepath:
+            print("> View file operation cancelled.")
+        else:
+            self.showViewer(filepath)
+
+    def printPathReport(self):
+        """Print lookup path hit statistics"""
+        if not os.path.exists(FileLoc.LOOKUP_MATRIX.value):
+            print("> Cannot report on lookups. Lookup Matrix cannot be found.")
+        else:
+            print("..Lookup Path Report..")
+            LookupHelper(load_files=False).printPathReport()
+
     # =======================
     #  GUI UTILITY FUNCTIONS
     # -----------------------
 
+    def showViewer(self, filepath):
+        """Open a file in a new in-app viewer window"""
+        print(f"..Loading {os.path.basename(filepath)} into viewer..")
+        viewer = DataViewer.fromFile(ExcelHelper(), filepath)
+        viewer.finished.connect(lambda: self.viewers.remove(viewer))
+        self.viewers.append(viewer)
+        viewer.show()
+
     def lockButtons(self):
         """Disable user interaction"""
         for element in self.all_elements:
@@ -173,8 +222,8 @@ class MainWindow(QDialog):
 
         # <= MAKE SURE WE HAVE ALL LOOKUP FILES READY =>
         excel_helper = ExcelHelper()
-        lookup_helper = LookupHelper()
-        value_lookups = lookup_helper.files.values()
+        # Only read file definitions until we know the run isn't skipped
+        value_lookups = LookupHelper(load_files=False).files.values()
         general_lookups = [FileLoc.FIELD_MAPPINGS.value, FileLoc.LOOKUP_MATRIX.value, FileLoc.FORMAT_MATRIX.value]
         lookup_files_ready = True
         for filepath in general_lookups + [file.path for file in value_lookups]:
@@ -206,38 +255,66 @@ class MainWindow(QDialog):
                       f' Please use "<LINE>@<YYYY-MM-DD>.xlsx"')
             else:
 
-                # <= BACKUP ALL UPDATABLE LOOKUP FILES =>
-                for file in lookup_helper.files.values():
-                    if file.updatable:
-                        excel_helper.backupFile(file.path)
-
-                # <= STANDARDIZE COLUMNS =>
-                print("..Standardizing Columns..")
-                standardize_helper = StandardizeHelper(line, filedate)
-                standard_df = standardize_helper.mapColumns(self.input_df)
-                standard_df = standardize_helper.preprocessColumns(standard_df)
-                standard_df = standardize_helper.generateColumns(standard_df)
-
-                # <= PERFORM LOOKUP ON STANDARD FILE =>
-                print("..Assigning FSE..")
-                lookup_helper.setStandardizeHelper(standardize_helper)
-                lookup_helper.setExcelHelper(excel_helper)
-                fse_df = lookup_helper.performLookup(standard_df, 'FSE Code')
-
-                # <= EXPORT FILE TO EXCEL =>
-                # Sort file
-                fse_df = fse_df.sort_values(by='Reported Customer',
-                                            ascending=True,
-                                            ignore_index=True)
-                fse_df = fse_df.reset_index(drop=True)
-                # Create output filepath
-                output_filepath = f"{FileLoc.OUTPUT.value}{filename}_(FSE)_{{" +\
-                                  standardize_helper.upload_timestamp + "}.xlsx"
-                excel_helper.createFile(output_filepath,
-                                        dfs=[fse_df],
-                                        sheets=['Data'],
-                                        widths=[standardize_helper.column_widths])
-                excel_helper.openFile(output_filepath)
+                # <= SKIP INPUTS WHICH WERE ALREADY PROCESSED =>
+                # Fingerprint the input along with every lookup file it depends on
+                fingerprint_helper = FingerprintHelper()
+                fingerprint = fingerprint_helper.fingerprint([self.input_filepath] + general_lookups +
+                                                             [file.path for file in value_lookups])
+                record = fingerprint_helper.getRecord("Assign FSE", fingerprint)
+                if record and os.path.exists(record["Output"]) and not self.chk_force_rerun.isChecked():
+                    print(f"> {self.input_filename} and lookup files are unchanged since the last run."
+                          f" Reusing {os.path.basename(record['Output'])}.")
+                    if self.chk_open_excel.isChecked():
+                        excel_helper.openFile(record["Output"])
+                else:
+
+                    # <= LOAD LOOKUP TABLES =>
+                    lookup_helper = getLookupHelper()
+
+                    # <= BACKUP ALL UPDATABLE LOOKUP FILES =>
+                    for file in lookup_helper.files.values():
+                        if file.updatable:
+                            excel_helper.backupFile(file.path)
+
+                    # <= STANDARDIZE COLUMNS =>
+                    print("..Standardizing Columns..")
+                    standardize_helper = StandardizeHelper(line, filedate)
+                    standard_df = standardize_helper.mapColumns(self.input_df)
+                    standard_df = standardize_helper.preprocessColumns(standard_df)
+                    standard_df = standardize_helper.generateColumns(standard_df)
+
+                    # <= PERFORM LOOKUP ON STANDARD FILE =>
+                    print("..Assigning FSE..")
+                    # Lookup file updates are queued for the export stage
+                    export_helper = ExportHelper(excel_helper)
+                    lookup_helper.setStandardizeHelper(standardize_helper)
+                    lookup_helper.setExcelHelper(excel_helper)
+                    lookup_helper.setExportHelper(export_helper)
+                    fse_df = lookup_helper.performLookup(standard_df, 'FSE Code')
+
+                    # <= EXPORT FILE TO EXCEL =>
+                    # Sort file
+                    fse_df = fse_df.sort_values(by='Reported Customer',
+                                                ascending=True,
+                                                ignore_index=True)
+                    fse_df = fse_df.reset_index(drop=True)
+                    # Create output filepath
+                    output_filepath = f"{FileLoc.OUTPUT.value}{filename}_(FSE)_{{" +\
+                                      standardize_helper.upload_timestamp + "}.xlsx"
+                    output_filepath = os.path.abspath(output_filepath)
+                    export_helper.addFile(output_filepath,
+                                          dfs=[fse_df],
+                                          sheets=['Data'],
+                                          widths=[standardize_helper.column_widths],
+                                          twin=Settings.TWIN_FORMAT.value)
+                    # Write the output and every updated lookup file together
+                    written_paths = export_helper.exportFiles(open_files=self.chk_open_excel.isChecked())
+
+                    # <= RECORD FINGERPRINT FOR FUTURE RE-RUNS =>
+                    if output_filepath in written_paths:
+                        fingerprint_helper.setRecord("Assign FSE", fingerprint,
+                                                     {"Input": self.input_filename,
+                                                      "Output": output_filepath})
 
         self.unlockButtons()
         self.deselectFile()
@@ -265,7 +342,17 @@ class MainWindow(QDialog):
             master_file_ready = False
             print(f"> Cannot add to master. Master file is open."
                   f" Please make sure file is not open in Excel.")
-        if lookup_files_ready and master_file_ready:
+        # Skip re-adding an identical input to a master which hasn't changed since
+        fingerprint_helper = FingerprintHelper()
+        input_hash = fingerprint_helper.hashFile(self.input_filepath)
+        record = fingerprint_helper.getRecord("Add To Master", input_hash)
+        already_added = False
+        if record and not self.chk_force_rerun.isChecked():
+            if record["Master"] == fingerprint_helper.hashFile(FileLoc.MASTER.value):
+                already_added = True
+                print(f"> {self.input_filename} is already in the commissions master"
+                      f" and nothing has changed. Check \"Force Re-Run\" to add it again.")
+        if lookup_files_ready and master_file_ready and not already_added:
 
             # <= CONFIRM USER WANTS TO ADD =>
             reply = QMessageBox.question(self, "Confirm Add To Master",
@@ -279,11 +366,8 @@ class MainWindow(QDialog):
                       f" Commissions master not updated.")
             else:
 
-                # <= BACKUP MASTER FILE =>
-                excel_helper.backupFile(FileLoc.MASTER.value)
-
                 # <= LOAD MASTER FILE =>
-                master_df = pd.read_excel(FileLoc.MASTER.value, sheet_name=0).fillna("")
+                master_df = excel_helper.readFile(FileLoc.MASTER.value, 'Data', use_twin=True)
 
                 # <= MAKE SURE ALL INPUT AND MASTER COLUMNS ARE STANDARD =>
                 field_mappings = pd.read_excel(FileLoc.FIELD_MAPPINGS.value, sheet_name=0).fillna("")
@@ -308,36 +392,53 @@ class MainWindow(QDialog):
                           f" Extra columns: {extra}")
                 else:
 
-                    # <= CLEAR OUT ANY IDENTICAL LINE/FILEDATE DATA =>
-                    unique_id_cols = ['Line', 'File Date']
-                    file_unique_id = list(self.input_df[unique_id_cols].iloc[0])
-                    # Create a condition that identifies rows to remove
-                    condition = pd.Series([True] * len(master_df), dtype=bool)
-                    for col, val in zip(unique_id_cols, file_unique_id):
-                        condition = condition & (master_df[col] == val)
-                    # Remove rows where condition is True
-                    master_df = master_df[~condition]
-                    print(f"> Removed previous {'@'.join(file_unique_id)}"
-                          f" data from master file.")
-
                     # <= APPEND TO MASTER =>
-                    master_df = pd.concat([self.input_df, master_df])
-                    master_df = master_df.sort_values(by=['Upload Timestamp', 'Reported Customer'],
-                                                      ascending=[False, True],
-                                                      ignore_index=True)
-                    master_df = master_df.reset_index(drop=True)
-
-                    # <= EXPORT MASTER FILE =>
+                    master_helper = MasterHelper(excel_helper)
                     column_widths = list(field_mappings.iloc[0])
-                    output_filepath = excel_helper.createFile(FileLoc.MASTER.value,
-                                                              dfs=[master_df],
-                                                              sheets=["Data"],
-                                                              widths=[column_widths])
-                    excel_helper.openFile(output_filepath)
+                    output_filepath = master_helper.addToMaster(self.input_df, column_widths)
+                    if output_filepath and self.chk_open_excel.isChecked():
+                        excel_helper.openFile(output_filepath)
+
+                    # <= RECORD FINGERPRINT FOR FUTURE RE-ADDS =>
+                    if output_filepath:
+                        master_hash = fingerprint_helper.hashFile(FileLoc.MASTER.value)
+                        fingerprint_helper.setRecord("Add To Master", input_hash,
+                                                     {"Input": self.input_filename,
+                                                      "Master": master_hash})
 
         self.unlockButtons()
         self.deselectFile()
 
+    def recodeMaster(self):
+        """Re-code master rows affected by lookup file corrections"""
+        print("..Re-coding Commissions Master..")
+
+        self.lockButtons()
+
+        # <= MAKE SURE WE HAVE ALL FILES READY =>
+        excel_helper = ExcelHelper()
+        lookup_helper = LookupHelper()
+        general_lookups = [FileLoc.FIELD_MAPPINGS.value, FileLoc.LOOKUP_MATRIX.value, FileLoc.FORMAT_MATRIX.value]
+        files_ready = True
+        for filepath in general_lookups + [file.path for file in lookup_helper.files.values()]:
+            filename = os.path.basename(filepath)
+            if not os.path.exists(filepath):
+                files_ready = False
+                print(f"> Cannot re-code master. Lookup file {filename} cannot be found."
+                      f" Please make sure file is in the Lookup directory.")
+        if excel_helper.saveError(FileLoc.MASTER.value):
+            files_ready = False
+            print(f"> Cannot re-code master. Master file is open."
+                  f" Please make sure file is not open in Excel.")
+        if files_ready:
+
+            # <= RE-CODE AFFECTED MASTER ROWS =>
+            recode_helper = RecodeHelper(lookup_helper, excel_helper)
+            if recode_helper.recodeMaster() > 0 and self.chk_open_excel.isChecked():
+                excel_helper.openFile(FileLoc.MASTER.value)
+
+        self.unlockButtons()
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -350,8 +451,8 @@ if __name__ == "__main__":
     widget.setFixedHeight(600)
     widget.show()
 
-try:
-    sys.exit(app.exec_())
-except Exception:
-    print("..Exiting..")
+    try:
+        sys.exit(app.exec_())
+    except Exception:
+        print("..Exiting..")
 
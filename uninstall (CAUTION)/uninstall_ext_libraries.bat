@@ -4,6 +4,7 @@ pip uninstall numpy
 pip uninstall xlrd
 pip uninstall openpyxl
 pip uninstall xlsxwriter
+pip uninstall pyarrow
 pip uninstall pywin32
 pip uninstall pywin32-ctypes
 pip uninstall requests